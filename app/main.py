@@ -1,7 +1,7 @@
 import time
 import numpy as np
-from fastapi import FastAPI, Depends, HTTPException, status, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -19,7 +19,9 @@ from app.schemas import (
     UserResponse,
     Token,
     LogSequenceRequest,
+    ColumnarLogSequenceRequest,
     AnomalyResponse,
+    BatchAnomalyResponse,
 )
 from app.auth import (
     authenticate_user,
@@ -29,10 +31,61 @@ from app.auth import (
     verify_admin_token,
 )
 from app.ml_model import get_ml_model
+from app.payloads import decode_log_batch_payload, decode_log_payload
 
 app = FastAPI(title="ML Service API", version="1.0.0")
 
 
+def _inline_schema(model) -> dict:
+    """JSON-схема модели с подставленными $defs (ссылки на них не видны из openapi)."""
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if ref is not None and ref.startswith("#/$defs/"):
+                return resolve(defs[ref.split("/")[-1]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(item) for item in node]
+        return node
+
+    return resolve(schema)
+
+
+# Тело /forward читается напрямую (orjson/msgpack), поэтому схема объявлена вручную
+LOG_SEQUENCE_SCHEMA = {
+    "oneOf": [_inline_schema(LogSequenceRequest), _inline_schema(ColumnarLogSequenceRequest)]
+}
+
+
+LOG_BATCH_SCHEMA = {
+    "type": "object",
+    "required": ["sequences"],
+    "properties": {
+        "sequences": {"type": "array", "minItems": 1, "items": LOG_SEQUENCE_SCHEMA},
+    },
+}
+
+
+def _openapi_request_body(schema: dict) -> dict:
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": schema},
+                "application/msgpack": {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    }
+
+
+def _history_result(result: dict) -> dict:
+    """Результат для истории запросов, без объяснения (оно может быть длинным)."""
+    return {key: value for key, value in result.items() if key != "explanation"}
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     return JSONResponse(status_code=400, content={"detail": "bad request"})
@@ -86,38 +139,56 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@app.post("/forward", response_model=AnomalyResponse)
+@app.post(
+    "/forward",
+    response_model=AnomalyResponse,
+    response_class=ORJSONResponse,
+    openapi_extra=_openapi_request_body(LOG_SEQUENCE_SCHEMA),
+)
 async def forward(
-    request: LogSequenceRequest,
+    request: Request,
+    explain: bool = False,
+    top_k: int = Query(10, ge=1, le=100),
     session: AsyncSession = Depends(get_database_session),
 ):
-    """Детекция аномалий в последовательности логов."""
+    """
+    Детекция аномалий в последовательности логов.
+
+    Принимает application/json или application/msgpack, в построчном
+    (`logs`) или колоночном (`messages` + словари компонентов и уровней) формате.
+    С `explain=true` в ответ добавляются top_k признаков TF-IDF, сильнее всего
+    укоротивших путь изоляции в лесу.
+    """
     start_time = time.time()
 
-    if not isinstance(request.logs, list) or len(request.logs) == 0:
+    try:
+        columns = decode_log_payload(await request.body(), request.headers.get("content-type", ""))
+    except ValueError:
         raise HTTPException(status_code=400, detail="bad request")
     try:
         model = get_ml_model()
-        logs_data = [log.model_dump() for log in request.logs]
-        result = model.predict_from_logs(logs_data)
+        result = model.predict_from_logs(columns, explain=explain, top_k=top_k)
 
         processing_time = time.time() - start_time
 
         history_record = RequestHistory(
             request_type="log_anomaly_detection",
             processing_time=processing_time,
-            input_data_size=len(logs_data),
+            input_data_size=result["num_events"],
             status_code=200,
-            result=str(result),
+            result=str(_history_result(result)),
         )
         session.add(history_record)
         await session.commit()
 
-        return AnomalyResponse(
-            score=result["score"],
-            is_anomaly=result["is_anomaly"],
-            threshold=result["threshold"],
-            num_events=result["num_events"],
+        return ORJSONResponse(
+            AnomalyResponse(
+                score=result["score"],
+                is_anomaly=result["is_anomaly"],
+                threshold=result["threshold"],
+                num_events=result["num_events"],
+                explanation=result.get("explanation"),
+            ).model_dump(exclude_none=True)
         )
 
     except Exception as e:
@@ -125,7 +196,65 @@ async def forward(
         history_record = RequestHistory(
             request_type="log_anomaly_detection",
             processing_time=processing_time,
-            input_data_size=len(request.logs),
+            input_data_size=len(columns.messages),
+            status_code=403,
+            error_message="модель не смогла обработать данные",
+        )
+        session.add(history_record)
+        await session.commit()
+        raise HTTPException(status_code=403, detail="модель не смогла обработать данные")
+
+
+@app.post(
+    "/forward/batch",
+    response_model=BatchAnomalyResponse,
+    response_class=ORJSONResponse,
+    openapi_extra=_openapi_request_body(LOG_BATCH_SCHEMA),
+)
+async def forward_batch(
+    request: Request,
+    explain: bool = False,
+    top_k: int = Query(10, ge=1, le=100),
+    session: AsyncSession = Depends(get_database_session),
+):
+    """Пакетная детекция аномалий для офлайн-разбора: `{"sequences": [...]}`."""
+    start_time = time.time()
+
+    try:
+        sequences = decode_log_batch_payload(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bad request")
+    input_data_size = sum(len(columns.messages) for columns in sequences)
+    try:
+        model = get_ml_model()
+        results = model.predict_from_logs_batch(sequences, explain=explain, top_k=top_k)
+
+        processing_time = time.time() - start_time
+
+        history_record = RequestHistory(
+            request_type="log_anomaly_detection_batch",
+            processing_time=processing_time,
+            input_data_size=input_data_size,
+            status_code=200,
+            result=str([_history_result(result) for result in results]),
+        )
+        session.add(history_record)
+        await session.commit()
+
+        return ORJSONResponse(
+            BatchAnomalyResponse(
+                results=[AnomalyResponse(**result) for result in results]
+            ).model_dump(exclude_none=True)
+        )
+
+    except Exception as e:
+        processing_time = time.time() - start_time
+        history_record = RequestHistory(
+            request_type="log_anomaly_detection_batch",
+            processing_time=processing_time,
+            input_data_size=input_data_size,
             status_code=403,
             error_message="модель не смогла обработать данные",
         )
@@ -209,6 +338,7 @@ async def root():
             "POST /register": "Register a new user",
             "POST /token": "Get JWT access token",
             "POST /forward": "Detect anomalies in log sequence (Isolation Forest)",
+            "POST /forward/batch": "Detect anomalies in several log sequences (offline triage)",
             "GET /history": "Get request history (admin only)",
             "DELETE /history": "Delete request history (requires admin token)",
             "GET /stats": "Get statistics (admin only)",
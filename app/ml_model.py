@@ -1,8 +1,24 @@
 import re
+from itertools import repeat
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 import joblib
+import numpy as np
+import scipy.sparse as sp
+from sklearn.utils import check_array
+
+from app.schemas import ColumnarLogSequenceRequest
+
+
+def _average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Ожидаемая длина пути c(n) в дереве изоляции из n объектов."""
+    n = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n)
+    result[n == 2] = 1.0
+    mask = n > 2
+    result[mask] = 2.0 * (np.log(n[mask] - 1.0) + np.euler_gamma) - 2.0 * (n[mask] - 1.0) / n[mask]
+    return result
 
 
 class LogAnomalyDetector:
@@ -28,6 +44,8 @@ class LogAnomalyDetector:
         self.model = artifacts["model"]
         self.vectorizer = artifacts["vectorizer"]
         self.threshold = artifacts["threshold"]
+        self._path_credits = None
+        self._feature_names = None
 
     def normalize_message(self, s: str) -> str:
         """Нормализация лог-сообщения."""
@@ -47,59 +65,250 @@ class LogAnomalyDetector:
         lvl = level.lower() if level else ""
         return f"{comp}_{lvl}__ {msg}"
 
-    def predict(self, tokenized_block: str) -> dict:
+    def _build_path_credits(self):
+        """
+        Вклад каждого ребра деревьев в укорочение пути изоляции.
+
+        Переход из узла с n_parent объектами в узел с n_child сокращает ожидаемую
+        оставшуюся длину пути на c(n_parent) - 1 - c(n_child); этот вклад
+        приписывается признаку, по которому сделано разбиение. Вдоль пути сумма
+        вкладов телескопируется в c(n_root) - h(x), поэтому score восстанавливается
+        из тех же обходов деревьев без отдельного вызова score_samples.
+        """
+        n_features = self.model.n_features_in_
+        tree_features, credit_matrices, root_lengths = [], [], []
+        for tree, features in zip(self.model.estimators_, self.model.estimators_features_):
+            t = tree.tree_
+            internal = np.flatnonzero(t.children_left >= 0)
+            parents = np.concatenate([internal, internal])
+            children = np.concatenate([t.children_left[internal], t.children_right[internal]])
+            split_features = t.feature[parents]
+            # Как и в IsolationForest, столбцы переиндексируются только при подвыборке признаков
+            features = np.asarray(features) if len(features) != n_features else None
+            if features is not None:
+                split_features = features[split_features]
+
+            lengths = _average_path_length(t.n_node_samples)
+            credits = lengths[parents] - 1.0 - lengths[children]
+            credit_matrices.append(
+                sp.csr_matrix((credits, (children, split_features)), shape=(t.node_count, n_features))
+            )
+            tree_features.append(features)
+            root_lengths.append(lengths[0])
+
+        self._path_credits = (tree_features, sp.vstack(credit_matrices).tocsr(), float(np.sum(root_lengths)))
+        self._check_path_credits()
+
+    def _check_path_credits(self):
+        """
+        Сверка score из вкладов с model.score_samples на выборке из словаря.
+
+        Разложение опирается на внутренние соглашения IsolationForest
+        (estimators_features_, max_samples_, длина пути depth + c(n_leaf)),
+        поэтому при их изменении в новой версии scikit-learn объяснения
+        отключаются с ошибкой, а не возвращаются молча неверными.
+        """
+        names = self._get_feature_names()
+        X = self.vectorizer.transform([" ".join(names[i::8]) for i in range(8)] + [""])
+        scores, _ = self._score_with_contributions(X)
+        if not np.allclose(scores, self.model.score_samples(X), rtol=0.0, atol=1e-9):
+            self._path_credits = None
+            raise RuntimeError("Path-length decomposition does not match IsolationForest.score_samples")
+
+    def _get_feature_names(self) -> np.ndarray:
+        if self._feature_names is None:
+            self._feature_names = self.vectorizer.get_feature_names_out()
+        return self._feature_names
+
+    def _score_with_contributions(self, X) -> tuple[np.ndarray, sp.csr_matrix]:
+        """
+        Score и вклады признаков за один обход деревьев.
+
+        Returns:
+            (scores, contributions): scores совпадают с model.score_samples(X),
+            contributions[i, j] - среднее по деревьям укорочение пути строки i
+            разбиениями по признаку j
+        """
+        if self._path_credits is None:
+            self._build_path_credits()
+        tree_features, credit_matrix, root_length = self._path_credits
+
+        # Как и IsolationForest, X приводится к float32 CSR один раз, а не в каждом дереве
+        X = check_array(X, accept_sparse="csr", dtype=np.float32)
+        paths = sp.hstack([
+            tree.decision_path(X if features is None else X[:, features], check_input=False)
+            for tree, features in zip(self.model.estimators_, tree_features)
+        ]).tocsr()
+        contributions = (paths @ credit_matrix).tocsr()
+
+        n_trees = len(self.model.estimators_)
+        depths = root_length - np.asarray(contributions.sum(axis=1)).ravel()
+        denominator = n_trees * _average_path_length([self.model.max_samples_])[0]
+        scores = -(2.0 ** (-depths / denominator))
+        return scores, contributions / n_trees
+
+    def _top_contributions(self, contributions: sp.csr_matrix, X: sp.csr_matrix, row: int, top_k: int) -> list[dict]:
+        """Признаки с наибольшим укорочением пути для строки row."""
+        start, end = contributions.indptr[row], contributions.indptr[row + 1]
+        indices = contributions.indices[start:end]
+        values = contributions.data[start:end]
+        positive = values > 0
+        indices, values = indices[positive], values[positive]
+        order = np.argsort(-values)[:top_k]
+        top_indices, top_values = indices[order], values[order]
+
+        # TF-IDF веса берутся из отсортированных индексов строки X без построения подматрицы
+        x_start, x_end = X.indptr[row], X.indptr[row + 1]
+        x_indices = X.indices[x_start:x_end]
+        tfidf = np.zeros(len(top_indices))
+        if len(x_indices):
+            positions = np.minimum(np.searchsorted(x_indices, top_indices), len(x_indices) - 1)
+            found = x_indices[positions] == top_indices
+            tfidf[found] = X.data[x_start:x_end][positions[found]]
+
+        names = self._get_feature_names()
+        return [
+            {"feature": str(names[j]), "contribution": float(c), "value": float(v)}
+            for j, c, v in zip(top_indices, top_values, tfidf)
+        ]
+
+    def predict_batch(self, tokenized_blocks: list[str], explain: bool = False, top_k: int = 10) -> list[dict]:
+        """
+        Предсказание для нескольких токенизированных последовательностей.
+
+        Args:
+            tokenized_blocks: Строки с токенами событий, разделёнными " . "
+            explain: Добавить признаки, сильнее всего укоротившие путь изоляции
+            top_k: Число признаков в объяснении
+
+        Returns:
+            list[dict] с полями: score, is_anomaly, threshold (и explanation при explain)
+        """
+        X = self.vectorizer.transform(tokenized_blocks)
+        if explain:
+            X.sort_indices()
+            scores, contributions = self._score_with_contributions(X)
+        else:
+            scores = self.model.score_samples(X)
+
+        results = []
+        for row, score in enumerate(scores):
+            result = {
+                "score": float(score),
+                "is_anomaly": bool(score <= self.threshold),
+                "threshold": self.threshold
+            }
+            if explain:
+                result["explanation"] = self._top_contributions(contributions, X, row, top_k)
+            results.append(result)
+        return results
+
+    def predict(self, tokenized_block: str, explain: bool = False, top_k: int = 10) -> dict:
         """
         Предсказание для токенизированной последовательности логов.
 
         Args:
             tokenized_block: Строка с токенами событий, разделёнными " . "
+            explain: Добавить признаки, сильнее всего укоротившие путь изоляции
+            top_k: Число признаков в объяснении
 
         Returns:
-            dict с полями: score, is_anomaly, threshold
+            dict с полями: score, is_anomaly, threshold (и explanation при explain)
         """
-        X = self.vectorizer.transform([tokenized_block])
-        score = float(self.model.score_samples(X)[0])
-        is_anomaly = score <= self.threshold
+        return self.predict_batch([tokenized_block], explain=explain, top_k=top_k)[0]
 
+    def tokenize_columns(self, columns: ColumnarLogSequenceRequest) -> list[str]:
+        """
+        Токенизация колоночного представления логов.
+
+        Компоненты и уровни нормализуются один раз на значение словаря,
+        а не на каждую запись.
+        """
+        comps = [c.split("$")[0].lower() for c in columns.component_dictionary]
+        lvls = [lvl.lower() for lvl in columns.level_dictionary]
+        comp_column = (comps[i] for i in columns.components) if columns.components else repeat("")
+        lvl_column = (lvls[i] for i in columns.levels) if columns.levels else repeat("")
+
+        return [
+            f"{comp}_{lvl}__ {self.normalize_message(message)}"
+            for message, comp, lvl in zip(columns.messages, comp_column, lvl_column)
+        ]
+
+    def _tokenize_logs(self, logs: Union[list[dict], ColumnarLogSequenceRequest]) -> list[str]:
+        if isinstance(logs, ColumnarLogSequenceRequest):
+            return self.tokenize_columns(logs)
+        return [
+            self.tokenize_log_entry(
+                log.get("message", ""), log.get("component", ""), log.get("level", "")
+            )
+            for log in logs
+        ]
+
+    def _empty_result(self) -> dict:
         return {
-            "score": score,
-            "is_anomaly": bool(is_anomaly),
-            "threshold": self.threshold
+            "score": None,
+            "is_anomaly": None,
+            "threshold": self.threshold,
+            "num_events": 0,
+            "error": "Empty log sequence"
         }
 
-    def predict_from_logs(self, logs: list[dict]) -> dict:
+    def predict_from_logs(
+        self,
+        logs: Union[list[dict], ColumnarLogSequenceRequest],
+        explain: bool = False,
+        top_k: int = 10,
+    ) -> dict:
         """
         Предсказание для списка лог-записей.
 
         Args:
             logs: Список словарей с ключами: message, component (опц.), level (опц.)
+                  или колоночное представление ColumnarLogSequenceRequest
+            explain: Добавить признаки, сильнее всего укоротившие путь изоляции
+            top_k: Число признаков в объяснении
 
         Returns:
-            dict с полями: score, is_anomaly, threshold, num_events
-        """
-        if not logs:
-            return {
-                "score": None,
-                "is_anomaly": None,
-                "threshold": self.threshold,
-                "num_events": 0,
-                "error": "Empty log sequence"
-            }
+            dict с полями: score, is_anomaly, threshold, num_events (и explanation при explain)
+        """
+        tokens = self._tokenize_logs(logs)
 
-        tokens = []
-        for log in logs:
-            message = log.get("message", "")
-            component = log.get("component", "")
-            level = log.get("level", "")
-            token = self.tokenize_log_entry(message, component, level)
-            tokens.append(token)
+        if not tokens:
+            return self._empty_result()
 
         tokenized_block = " . ".join(tokens)
-        result = self.predict(tokenized_block)
-        result["num_events"] = len(logs)
+        result = self.predict(tokenized_block, explain=explain, top_k=top_k)
+        result["num_events"] = len(tokens)
 
         return result
 
+    def predict_from_logs_batch(
+        self,
+        sequences: list[Union[list[dict], ColumnarLogSequenceRequest]],
+        explain: bool = False,
+        top_k: int = 10,
+    ) -> list[dict]:
+        """
+        Пакетное предсказание для офлайн-разбора: все последовательности
+        векторизуются и проходят через лес одним вызовом.
+
+        Returns:
+            list[dict] с полями: score, is_anomaly, threshold, num_events (и explanation при explain)
+        """
+        token_lists = [self._tokenize_logs(logs) for logs in sequences]
+        blocks = [" . ".join(tokens) for tokens in token_lists if tokens]
+        scored = iter(self.predict_batch(blocks, explain=explain, top_k=top_k) if blocks else [])
+
+        results = []
+        for tokens in token_lists:
+            if not tokens:
+                results.append(self._empty_result())
+                continue
+            result = next(scored)
+            result["num_events"] = len(tokens)
+            results.append(result)
+        return results
+
 
 # Глобальный экземпляр модели
 ml_model: Optional[LogAnomalyDetector] = None
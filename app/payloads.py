@@ -0,0 +1,57 @@
+import msgpack
+import orjson
+
+from app.schemas import ColumnarLogSequenceRequest
+
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def _load_body(body: bytes, content_type: str):
+    media_type = content_type.split(";")[0].strip().lower()
+    try:
+        if media_type in MSGPACK_CONTENT_TYPES:
+            data = msgpack.unpackb(body, raw=False)
+        else:
+            data = orjson.loads(body)
+    except Exception as exc:
+        raise ValueError("Malformed request body") from exc
+
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be an object")
+    return data
+
+
+def _to_columns(data) -> ColumnarLogSequenceRequest:
+    if not isinstance(data, dict):
+        raise ValueError("Log sequence must be an object")
+    if "messages" in data:
+        return ColumnarLogSequenceRequest.model_validate(data)
+    return ColumnarLogSequenceRequest.from_rows(data.get("logs"))
+
+
+def decode_log_payload(body: bytes, content_type: str) -> ColumnarLogSequenceRequest:
+    """
+    Разбор тела запроса /forward в колоночный формат.
+
+    Поддерживаются JSON (orjson) и MessagePack, в каждом из них - как
+    построчный формат `{"logs": [...]}`, так и колоночный
+    (`messages`, `components`, `levels` + словари).
+
+    Raises:
+        ValueError: если тело не удалось разобрать или оно не прошло валидацию
+    """
+    return _to_columns(_load_body(body, content_type))
+
+
+def decode_log_batch_payload(body: bytes, content_type: str) -> list[ColumnarLogSequenceRequest]:
+    """
+    Разбор тела запроса /forward/batch: `{"sequences": [...]}`, где каждый
+    элемент - последовательность в любом из форматов /forward.
+
+    Raises:
+        ValueError: если тело не удалось разобрать или оно не прошло валидацию
+    """
+    sequences = _load_body(body, content_type).get("sequences")
+    if not isinstance(sequences, list) or not sequences:
+        raise ValueError("sequences must be a non-empty list")
+    return [_to_columns(sequence) for sequence in sequences]
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 
 class LogEntry(BaseModel):
@@ -13,11 +13,87 @@ class LogSequenceRequest(BaseModel):
     logs: list[LogEntry] = Field(..., min_length=1, description="Список лог-записей")
 
 
+class ColumnarLogSequenceRequest(BaseModel):
+    """
+    Колоночный формат последовательности логов.
+
+    Сообщения передаются параллельным массивом, а компоненты и уровни
+    закодированы словарём: `components[i]` и `levels[i]` - индексы
+    в `component_dictionary` и `level_dictionary`. Пустой массив кодов
+    означает, что поле не задано ни для одной записи.
+    """
+
+    messages: list[str] = Field(..., min_length=1, description="Сообщения лог-записей")
+    component_dictionary: list[str] = Field(default_factory=list)
+    components: list[int] = Field(default_factory=list)
+    level_dictionary: list[str] = Field(default_factory=list)
+    levels: list[int] = Field(default_factory=list)
+
+    @model_validator(mode="after")
+    def validate_columns(self) -> "ColumnarLogSequenceRequest":
+        size = len(self.messages)
+        for codes, dictionary in (
+            (self.components, self.component_dictionary),
+            (self.levels, self.level_dictionary),
+        ):
+            if codes and len(codes) != size:
+                raise ValueError("Code arrays must have the same length as messages")
+            if codes and (min(codes) < 0 or max(codes) >= len(dictionary)):
+                raise ValueError("Code is out of dictionary range")
+        return self
+
+    @classmethod
+    def from_rows(cls, rows: list) -> "ColumnarLogSequenceRequest":
+        """Перевод построчного формата (`logs`) в колоночный без создания LogEntry."""
+        if not isinstance(rows, list) or not rows:
+            raise ValueError("logs must be a non-empty list")
+
+        messages: list[str] = []
+        components: list[int] = []
+        levels: list[int] = []
+        component_codes: dict[str, int] = {}
+        level_codes: dict[str, int] = {}
+        for row in rows:
+            if not isinstance(row, dict):
+                raise ValueError("log entry must be an object")
+            message = row.get("message")
+            component = row.get("component")
+            level = row.get("level")
+            if component is None:
+                component = ""
+            if level is None:
+                level = ""
+            if not isinstance(message, str) or not isinstance(component, str) or not isinstance(level, str):
+                raise ValueError("log entry fields must be strings")
+            messages.append(message)
+            components.append(component_codes.setdefault(component, len(component_codes)))
+            levels.append(level_codes.setdefault(level, len(level_codes)))
+
+        return cls.model_construct(
+            messages=messages,
+            component_dictionary=list(component_codes),
+            components=components,
+            level_dictionary=list(level_codes),
+            levels=levels,
+        )
+
+
+class FeatureContribution(BaseModel):
+    feature: str = Field(..., description="Токен или биграмма из словаря TF-IDF")
+    contribution: float = Field(..., description="Среднее по деревьям укорочение пути изоляции")
+    value: float = Field(..., description="TF-IDF вес признака в последовательности")
+
+
 class AnomalyResponse(BaseModel):
     score: float
     is_anomaly: bool
     threshold: float
     num_events: int
+    explanation: Optional[list[FeatureContribution]] = None
+
+
+class BatchAnomalyResponse(BaseModel):
+    results: list[AnomalyResponse]
 
 
 class HistoryItem(BaseModel):
@@ -0,0 +1,99 @@
+"""
+Сравнение форматов запроса /forward: размер тела и end-to-end латентность.
+
+Форматы:
+    rows-json        - исходный построчный JSON {"logs": [...]}
+    columnar-json    - колоночный JSON (messages + словари компонентов и уровней)
+    columnar-msgpack - колоночный MessagePack
+
+Запуск (сервис должен быть поднят):
+    python benchmarks/forward_payloads.py --url http://localhost:8000 --events 5000
+"""
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import msgpack
+import orjson
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.payloads import decode_log_payload  # noqa: E402
+from app.schemas import ColumnarLogSequenceRequest, LogSequenceRequest  # noqa: E402
+
+TEST_LOGS_DIR = Path(__file__).resolve().parent.parent / "test_logs"
+
+
+def load_rows(num_events: int) -> list[dict]:
+    """Последовательность из num_events записей, собранная из test_logs/*.json."""
+    source = []
+    for path in sorted(TEST_LOGS_DIR.glob("*.json")):
+        source.extend(json.loads(path.read_text())["logs"])
+    return list(itertools.islice(itertools.cycle(source), num_events))
+
+
+def build_payloads(rows: list[dict]) -> dict[str, tuple[str, bytes]]:
+    columns = ColumnarLogSequenceRequest.from_rows(rows).model_dump()
+    return {
+        "rows-json": ("application/json", json.dumps({"logs": rows}).encode()),
+        "columnar-json": ("application/json", orjson.dumps(columns)),
+        "columnar-msgpack": ("application/msgpack", msgpack.packb(columns)),
+    }
+
+
+def legacy_decode(body: bytes) -> list[dict]:
+    """Прежний путь: валидация каждой LogEntry и копия обратно в dict."""
+    request = LogSequenceRequest.model_validate_json(body)
+    return [log.model_dump() for log in request.logs]
+
+
+def post(url: str, content_type: str, body: bytes) -> float:
+    request = urllib.request.Request(
+        f"{url}/forward", data=body, headers={"Content-Type": content_type}, method="POST"
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--decode-only", action="store_true", help="не обращаться к сервису")
+    args = parser.parse_args()
+
+    payloads = build_payloads(load_rows(args.events))
+
+    print(f"events: {args.events}")
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        legacy_decode(payloads["rows-json"][1])
+    print(f"rows-json decode via LogEntry models: {(time.perf_counter() - start) / args.repeats * 1000:.2f} ms")
+
+    print(f"{'format':<18}{'size, KB':>10}{'decode, ms':>12}{'p50, ms':>10}{'p95, ms':>10}")
+    for name, (content_type, body) in payloads.items():
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            decode_log_payload(body, content_type)
+        decode_ms = (time.perf_counter() - start) / args.repeats * 1000
+
+        p50 = p95 = float("nan")
+        if not args.decode_only:
+            post(args.url, content_type, body)
+            timings = sorted(post(args.url, content_type, body) * 1000 for _ in range(args.repeats))
+            p50 = statistics.median(timings)
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+        print(f"{name:<18}{len(body) / 1024:>10.1f}{decode_ms:>12.2f}{p50:>10.2f}{p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()